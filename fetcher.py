@@ -0,0 +1,498 @@
+import urllib.parse
+import urllib.error
+import http.client
+import io
+import hashlib
+import threading
+import random
+import time
+import os
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+'''
+Everything that gets downloaded from sec.gov should go through fetch() so that the plumbing for talking to EDGAR
+only has to live in one place
+'''
+
+class ResponseCache():
+	'''
+	Keeps response bodies on disk, one file per url named by the hash of the url. Archived filings never change so
+	anything under /Archives/ is kept until it gets evicted, the browse and search pages do change so those expire
+	after ttl seconds. When the cache grows past max_bytes the least recently used files are thrown out.
+	'''
+	def __init__(self, directory, ttl=24*60*60, max_bytes=2*1024**3):
+		self.directory = directory
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self._size = None
+		self._lock = threading.Lock()
+
+	def _path(self, url):
+		digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+		return os.path.join(self.directory, digest[0:2], digest)
+
+	def _permanent(self, url):
+		return '/Archives/' in url
+
+	def get(self, url):
+		path = self._path(url)
+		try:
+			stats = os.stat(path)
+		except FileNotFoundError:
+			return None
+		if not self._permanent(url) and time.time() - stats.st_mtime > self.ttl:
+			return None
+		try:
+			with open(path, 'rb') as f:
+				data = f.read()
+			os.utime(path, (time.time(), stats.st_mtime)) #access time is what eviction goes by
+		except FileNotFoundError:
+			return None #evicted by someone else in the meantime
+		return data
+
+	def read_chunks(self, url, chunk_size):
+		'''
+		get() a piece at a time, so a big document never has to be in memory all at once
+		:return: GENERATOR of bytes, None if the url isn't cached
+		'''
+		path = self._path(url)
+		try:
+			stats = os.stat(path)
+			if not self._permanent(url) and time.time() - stats.st_mtime > self.ttl:
+				return None
+			f = open(path, 'rb')
+			os.utime(path, (time.time(), stats.st_mtime))
+		except FileNotFoundError:
+			return None
+		def chunks():
+			with f:
+				while True:
+					chunk = f.read(chunk_size)
+					if not chunk:
+						return
+					yield chunk
+		return chunks()
+
+	def writer(self, url):
+		'''
+		:return: TUPLE temporary path and the file open on it, write the body to it and hand both to commit()
+		'''
+		path = self._path(url)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		temp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+		return temp, open(temp, 'wb')
+
+	def commit(self, url, temp, f):
+		size = f.tell()
+		f.close()
+		path = self._path(url)
+		with self._lock:
+			try:
+				size -= os.stat(path).st_size #a refreshed page replaces its old copy, only the difference is new
+			except FileNotFoundError:
+				pass
+			os.replace(temp, path) #readers never see half a file
+			if self._size is None:
+				self._size = self._disk_size()
+			else:
+				self._size += size
+			if self._size > self.max_bytes:
+				self._evict()
+
+	def discard(self, temp, f):
+		f.close()
+		try:
+			os.remove(temp)
+		except FileNotFoundError:
+			pass
+
+	def put(self, url, data):
+		temp, f = self.writer(url)
+		try:
+			f.write(data)
+		except Exception:
+			self.discard(temp, f)
+			raise
+		self.commit(url, temp, f)
+
+	def _entries(self):
+		entries = []
+		for root, dirs, files in os.walk(self.directory):
+			for name in files:
+				if name.endswith('.tmp'):
+					continue
+				path = os.path.join(root, name)
+				try:
+					stats = os.stat(path)
+				except FileNotFoundError:
+					continue
+				entries.append((stats.st_atime, stats.st_size, path))
+		return entries
+
+	def _disk_size(self):
+		return sum([x[1] for x in self._entries()])
+
+	def _evict(self):
+		'''
+		drops the least recently used files until the cache is back down to 90% of max_bytes
+		:return:
+		'''
+		entries = self._entries()
+		entries.sort()
+		size = sum([x[1] for x in entries])
+		target = self.max_bytes * 0.9
+		for atime, fsize, path in entries:
+			if size <= target:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			size -= fsize
+		self._size = size
+
+	def clear(self):
+		with self._lock:
+			for atime, fsize, path in self._entries():
+				try:
+					os.remove(path)
+				except FileNotFoundError:
+					pass
+			self._size = 0
+
+
+class StreamBroken(Exception):
+	'''
+	raised by fetch_stream when a body stops coming partway through, whatever was already handed over is incomplete
+	and the document has to be started again from the beginning
+	'''
+	pass
+
+
+class RateLimiter():
+	'''
+	Every request to EDGAR has to take a token from this bucket first, so no matter how many threads are fetching
+	the whole process stays under rate requests per second. Give it a state_file and the bucket lives in that file
+	instead, so several processes pointed at the same file share one budget.
+
+	Throttled (403/429) and server error (5xx) responses are retried with jittered exponential backoff. Being
+	throttled also halves the number of requests allowed in flight, which then creeps back up while requests succeed.
+	'''
+	throttle_codes = [403, 429]
+
+	def __init__(self, rate=10.0, burst=None, concurrency=8, retries=5, backoff=1.0, max_backoff=60.0, state_file=None):
+		if state_file and not fcntl:
+			raise Exception("Sharing a rate limit between processes needs fcntl")
+		self.rate = rate
+		self.burst = burst or rate
+		self.max_concurrency = concurrency
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.state_file = state_file
+		self._tokens = self.burst
+		self._last = time.monotonic()
+		self._bucket_lock = threading.Lock()
+		self._limit = float(concurrency)
+		self._in_flight = 0
+		self._slots = threading.Condition()
+
+	def _take_local(self):
+		with self._bucket_lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+			self._last = now
+			if self._tokens >= 1:
+				self._tokens -= 1
+				return 0
+			return (1 - self._tokens) / self.rate
+
+	def _take_shared(self):
+		with open(self.state_file, 'a+') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			try:
+				f.seek(0)
+				state = f.read().split()
+				now = time.time()
+				if len(state) == 2:
+					tokens, last = float(state[0]), float(state[1])
+				else:
+					tokens, last = self.burst, now
+				tokens = min(self.burst, tokens + (now - last) * self.rate)
+				wait = 0
+				if tokens >= 1:
+					tokens -= 1
+				else:
+					wait = (1 - tokens) / self.rate
+				f.seek(0)
+				f.truncate()
+				f.write("{} {}".format(tokens, now))
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+		return wait
+
+	def acquire(self):
+		'''
+		blocks until a request is allowed to go out
+		:return:
+		'''
+		while True:
+			if self.state_file:
+				wait = self._take_shared()
+			else:
+				wait = self._take_local()
+			if wait <= 0:
+				return
+			time.sleep(wait)
+
+	def _enter(self):
+		with self._slots:
+			while self._in_flight >= int(self._limit):
+				self._slots.wait()
+			self._in_flight += 1
+
+	def _leave(self, throttled):
+		with self._slots:
+			self._in_flight -= 1
+			if throttled:
+				self._limit = max(1.0, self._limit / 2)
+				with self._bucket_lock:
+					self._tokens = 0 #everybody waits a little
+			else:
+				self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+			self._slots.notify_all()
+
+	def _throttled(self, error):
+		return isinstance(error, urllib.error.HTTPError) and error.code in self.throttle_codes
+
+	def _retryable(self, error):
+		if isinstance(error, urllib.error.HTTPError):
+			return error.code in self.throttle_codes or error.code >= 500
+		return isinstance(error, (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError))
+
+	def _delay(self, attempt, error):
+		delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+		delay = random.uniform(delay / 2, delay)
+		retry_after = None
+		if isinstance(error, urllib.error.HTTPError) and error.headers:
+			retry_after = error.headers.get("Retry-After")
+		if retry_after and retry_after.isdigit():
+			delay = max(delay, min(self.max_backoff, float(retry_after)))
+		return delay
+
+	def call(self, func, *args):
+		'''
+		runs func(*args) once a token and a slot are available, retrying it when EDGAR pushes back
+		:return: whatever func returns
+		'''
+		attempt = 0
+		while True:
+			self._enter()
+			try:
+				self.acquire()
+				result = func(*args)
+			except Exception as e:
+				self._leave(self._throttled(e))
+				if not self._retryable(e) or attempt >= self.retries:
+					raise
+				delay = self._delay(attempt, e)
+				print("Retrying in {:.1f} seconds after: {}".format(delay, e))
+			else:
+				self._leave(False)
+				return result
+			time.sleep(delay)
+			attempt += 1
+
+
+class ConnectionPool():
+	'''
+	urlopen opens a new connection (and does a new TLS handshake) for every document and closes it afterwards.
+	This keeps finished connections around per host so the next document from www.sec.gov goes out on one that
+	is already open, whichever filing or ticker it belongs to. Errors come back as urllib.error.HTTPError like
+	urlopen so callers don't need to care which one they are talking to.
+	'''
+	redirect_codes = [301, 302, 303, 307, 308]
+
+	def __init__(self, per_host=8, timeout=60, max_redirects=5):
+		self.per_host = per_host
+		self.timeout = timeout
+		self.max_redirects = max_redirects
+		self._idle = {}
+		self._lock = threading.Lock()
+
+	def _connect(self, key):
+		scheme, host = key
+		if scheme == 'https':
+			return http.client.HTTPSConnection(host, timeout=self.timeout)
+		return http.client.HTTPConnection(host, timeout=self.timeout)
+
+	def _checkout(self, key):
+		with self._lock:
+			idle = self._idle.get(key)
+			if idle:
+				return idle.pop(), True
+		return self._connect(key), False
+
+	def _checkin(self, key, conn):
+		with self._lock:
+			idle = self._idle.setdefault(key, [])
+			if len(idle) < self.per_host:
+				idle.append(conn)
+				return
+		conn.close()
+
+	def _send(self, url, headers):
+		parts = urllib.parse.urlsplit(url)
+		key = (parts.scheme, parts.netloc)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
+		conn, reused = self._checkout(key)
+		try:
+			conn.request('GET', path, headers=headers)
+			resp = conn.getresponse()
+		except BaseException as e:
+			conn.close() #whatever went wrong, this socket is no good to anybody now
+			if not reused or not isinstance(e, (http.client.HTTPException, ConnectionError)):
+				raise
+			#the server closed an idle connection on us, that's not a real failure so go again on a fresh one
+			conn = self._connect(key)
+			try:
+				conn.request('GET', path, headers=headers)
+				resp = conn.getresponse()
+			except BaseException:
+				conn.close()
+				raise
+		return key, conn, resp
+
+	def release(self, key, conn, resp):
+		'''
+		hands a connection back once its response has been read to the end
+		:return:
+		'''
+		if resp.will_close or not resp.isclosed():
+			conn.close()
+		else:
+			self._checkin(key, conn)
+
+	def open(self, url, headers=None):
+		'''
+		sends the request and follows redirects, the body is left for the caller to read
+		:return: TUPLE key, connection and response, pass them back to release() after reading the body
+		'''
+		for i in range(0, self.max_redirects + 1):
+			key, conn, resp = self._send(url, headers or {})
+			if resp.status < 300:
+				return key, conn, resp
+			try:
+				body = resp.read()
+			except Exception:
+				conn.close()
+				raise
+			self.release(key, conn, resp)
+			location = resp.getheader('Location')
+			if resp.status in self.redirect_codes and location:
+				url = urllib.parse.urljoin(url, location)
+				continue
+			raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.msg, io.BytesIO(body))
+		raise urllib.error.HTTPError(url, resp.status, "Too many redirects", resp.msg, None)
+
+	def request(self, url, headers=None):
+		'''
+		:return: BYTES body of the response
+		'''
+		key, conn, resp = self.open(url, headers)
+		try:
+			body = resp.read()
+		except Exception:
+			conn.close()
+			raise
+		self.release(key, conn, resp)
+		return body
+
+	def close(self):
+		with self._lock:
+			for idle in self._idle.values():
+				for conn in idle:
+					conn.close()
+			self._idle = {}
+
+
+#set cache to None to always go to the network, limiter to None to send requests as fast as they come
+cache = ResponseCache("edgar_cache")
+limiter = RateLimiter()
+pool = ConnectionPool()
+
+def _download(url, headers):
+	return pool.request(url, headers)
+
+def fetch(url, headers=None, use_cache=True):
+	'''
+	:param url: STRING document to get
+	:param headers: DICT headers to send if the document has to be downloaded
+	:param use_cache: BOOL False always downloads, the fresh copy still goes into the cache
+	:return: BYTES body of the response
+	'''
+	if cache and use_cache:
+		data = cache.get(url)
+		if data is not None:
+			return data
+	if limiter:
+		data = limiter.call(_download, url, headers or {})
+	else:
+		data = _download(url, headers or {})
+	if cache:
+		cache.put(url, data)
+	return data
+
+def fetch_stream(url, headers=None, use_cache=True, chunk_size=64*1024):
+	'''
+	fetch() for documents that get parsed as they come in. The body is handed over in chunks straight off the socket
+	(or the cache file) and written to the cache on the way through, so parsing overlaps the download and the
+	whole document is never held in memory. Only sending the request and getting its status goes through the rate
+	limiter's retries, once the body has started coming in a broken connection raises StreamBroken and it's up to
+	the caller to start over.
+	:param url: STRING document to get
+	:param headers: DICT headers to send if the document has to be downloaded
+	:param use_cache: BOOL False always downloads, the fresh copy still goes into the cache
+	:param chunk_size: INT most bytes handed over at once
+	:return: GENERATOR of bytes
+	'''
+	if cache and use_cache:
+		chunks = cache.read_chunks(url, chunk_size)
+		if chunks is not None:
+			yield from chunks
+			return
+	if limiter:
+		key, conn, resp = limiter.call(pool.open, url, headers or {})
+	else:
+		key, conn, resp = pool.open(url, headers or {})
+	temp = f = None
+	try:
+		if cache:
+			temp, f = cache.writer(url)
+		while True:
+			try:
+				chunk = resp.read(chunk_size)
+			except (http.client.HTTPException, OSError) as e:
+				raise StreamBroken("{} stopped partway through: {}".format(url, e)) from e
+			if not chunk:
+				if resp.length:
+					#read(amt) just comes back empty when the connection closes before Content-Length was sent
+					raise StreamBroken("{} stopped partway through, {} bytes short".format(url, resp.length))
+				break
+			if f:
+				f.write(chunk)
+			yield chunk
+	except BaseException:
+		#GeneratorExit included, a body that wasn't read to the end can't go in the cache or back in the pool
+		conn.close()
+		if f:
+			cache.discard(temp, f)
+		raise
+	pool.release(key, conn, resp)
+	if f:
+		cache.commit(url, temp, f)
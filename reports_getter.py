@@ -1,19 +1,132 @@
 #!/Users/Jon/anaconda3/envs/trading/bin/python3
 from bs4 import BeautifulSoup
-import urllib.request
 import json
 import random
 import re
 import copy
+import threading
+from collections import OrderedDict, Counter
 import time
-import datetime
 import html
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import fetcher
+from xbrl_instance import parse_instance, index_soup, InstanceParser
 
 '''
 The url given should be that of the page that contains the data files, just give it that, and then read off the hfrefs
 '''
 base = 'https://www.sec.gov'
 
+def key_path(key):
+	'''
+	Reports saved before flatlist entries had a path only have the key, an address like
+	['Assets']['items']['AssetsCurrent'], this turns that into the path ['Assets', 'AssetsCurrent']
+	'''
+	return re.findall(r"\['([^']*)'\]", key)[0::2]
+
+def entry_path(entry):
+	if 'path' in entry:
+		return entry['path']
+	return key_path(entry['key'])
+
+def table_node(table, path, create=False):
+	'''
+	walks down a statement table to the {'items':..., 'value':...} node at the end of path
+	:param table: DICT statement table
+	:param path: LIST concept names from the top of the table down
+	:param create: BOOL make any missing nodes along the way
+	:return: DICT the node
+	'''
+	node = None
+	items = table
+	for name in path:
+		if create and name not in items:
+			items[name] = {'items': {}, 'value': None}
+		node = items[name]
+		items = node['items']
+	return node
+
+class WordIndex():
+	'''
+	Inverted index over a statement's flatlist. An entry's id is its place in the flatlist, words maps every word in
+	the entries to the ids of the entries that have it, so a search only looks at entries that share a word with it.
+	concepts does the same for the lower cased concept name of each entry.
+	levels splits the ids up by level and parent/children link each entry to the one above it and the ones below it
+	'''
+	def __init__(self, flatlist):
+		self.entries = flatlist
+		self.words = {}
+		self.concepts = {}
+		self.levels = {}
+		self.parent = []
+		self.children = {}
+		by_path = {}
+		for i, entry in enumerate(flatlist):
+			for word in set(entry['words']):
+				self.words.setdefault(word, []).append(i)
+			self.concepts.setdefault(entry['search'].lower(), []).append(i)
+			self.levels.setdefault(int(entry['level']), set()).add(i)
+			path = tuple(entry_path(entry))
+			by_path.setdefault(path, i)
+			up = by_path.get(path[:-1])  # a parent always comes before its children in the flatlist
+			self.parent.append(up)
+			if up is not None:
+				self.children.setdefault(up, []).append(i)
+
+	def below(self, ids):
+		'''
+		:return: SET ids of every entry anywhere under any of ids
+		'''
+		found = set()
+		stack = list(ids)
+		while stack:
+			for child in self.children.get(stack.pop(), ()):
+				if child not in found:
+					found.add(child)
+					stack.append(child)
+		return found
+
+	def ids(self, words):
+		'''
+		:return: SET ids of the entries that have any of words
+		'''
+		found = set()
+		for word in words:
+			found.update(self.words.get(word, ()))
+		return found
+
+	def scores(self, terms, exclude=None, within=None):
+		'''
+		:param terms: LIST words to look for, a word given twice counts twice
+		:param exclude: LIST entries with any of these words are left out
+		:param within: SET only score these ids, every entry if not given
+		:return: DICT entry id -> how many of terms the entry matched, only entries that matched at least one
+		'''
+		scores = {}
+		for term, count in Counter(terms).items():
+			for i in self.words.get(term, ()):
+				if within is None or i in within:
+					scores[i] = scores.get(i, 0) + count
+		if exclude:
+			for i in self.ids(exclude).intersection(scores):
+				del scores[i]
+		return scores
+
+def number(text):
+	'''
+	fact values come in as text, returns an int or float or None if it isn't a number
+	'''
+	try:
+		return int(text)
+	except ValueError:
+		pass
+	try:
+		return float(text)
+	except ValueError:
+		return None
+
 class Financials():
 	u_agents = [
 		"Mozilla/5.0 (Windows; U; Windows NT 6.2) AppleWebKit/532.25.3 (KHTML, like Gecko) Version/5.0.3 Safari/532.25.3",
@@ -30,14 +143,23 @@ class Financials():
 		'equitychange': ['changes', 'change', 'in', 'stockholders', 'equity'],
 		'parenthetical': ['balance', 'sheet', '(parenthetical)', 'parenthetical', 'condensed']
 	}
+	_keywords = {key: Counter(words) for key, words in statement_refs.items()}  # a word listed twice counts twice
+	_role_scores = OrderedDict()  # (roleURI, definition) -> {statement key: score}, most recent last
+	_role_scores_size = 4096  # a filing has dozens of roles, this holds a good few companies' worth
+	_role_scores_lock = threading.Lock()
 	base = 'https://www.sec.gov'
-	def u_agent(self):
-		return random.choice(self.u_agents)
+	needed = ['instance', 'schema', 'calculation']  # what the tables are built from, fetched up front together
+	_structures = OrderedDict()  # (role, arcs, balance sheet) -> (flatlist, missing liabilities), most recent last
+	_structures_size = 256
+	_structures_lock = threading.Lock()
+	@classmethod
+	def u_agent(cls):
+		return random.choice(cls.u_agents)
 
 	def has_data(self):
 		return self._docs_available
 
-	def _pmatch(self, definition, keywords_list):
+	def _pmatch(self, definition, keywords):
 		if 'statement' not in definition.lower():
 			return 0
 		elif 'parenthetical' not in definition.lower():
@@ -45,17 +167,12 @@ class Financials():
 		else:
 			check_def = self._clean_definition(definition)
 			check_def = check_def.split(sep=' ')
-			num_matches = 0
-			for word in check_def:
-				for key in keywords_list:
-					if word == key:
-						num_matches += 1
-			return num_matches
+			return sum([keywords[word] for word in check_def])
 
-	def _matches(self, definition, keywords_list):
+	def _matches(self, definition, keywords):
 		'''
         :param definition:
-        :param keywords_list:
+        :param keywords: Counter of the words to look for, how many times a word is in it is what it's worth
         :return:
         '''
 		# statement check
@@ -66,12 +183,7 @@ class Financials():
 		else:
 			check_def = self._clean_definition(definition)
 			check_def = check_def.split(sep=' ')
-			num_matches = 0
-			for word in check_def:
-				for key in keywords_list:
-					if word == key:
-						num_matches += 1
-			return num_matches
+			return sum([keywords[word] for word in check_def])
 
 	def _clean_definition(self, definition):
 		'''
@@ -81,16 +193,7 @@ class Financials():
         :return:
         '''
 		clean = html.unescape(definition)
-		new_str = ''
-		for letter in clean:
-			if not letter.isalnum():
-				if letter == ' ':
-					new_str += letter
-				else:
-					continue
-			else:
-				new_str += letter
-		return new_str.lower()
+		return ''.join([x for x in clean if x == ' ' or x.isalnum()]).lower()
 
 	def display(self):
 		for statement in self.documents.keys():
@@ -102,12 +205,20 @@ class Financials():
 		print("Cash Flows       - {}".format(self.cash_flow_context))
 		print("Income Statement - {}".format(self.income_statement_context))
 
-	def __init__(self, index_url, from_document=False):
+	def __init__(self, index_url, from_document=False, dump=True, engine='soup', raw=None):
 		'''
         Given a landing page with the xbrl, will collect filings and create tables
         :param index_url:
+        :param dump: BOOL write the finished tables to qreport.json, turn this off when building several reports at once
+        :param engine: STRING 'soup' parses the instance with BeautifulSoup, 'stream' streams it through lxml into
+        compact tables which is much lighter on big filings, and parses it while it's still downloading
+        :param raw: DICT documents already downloaded by fetch_raw, nothing gets fetched when this is given
         '''
 		self._cik = "nothing to see here"
+		self._engine = engine
+		self._index_url = index_url
+		self._links = None
+		self._concept_names = {}  # arc label -> concept name, labels are the filer's own so this only lives for one report
 		self._docs_available = False
 		self._defunct = False
 		self.documents = None
@@ -135,8 +246,11 @@ class Financials():
 				"schema": None,
 				"calculation": None,
 				"presentation": None
-			}  # there are more documents but these are the most useful
-			self._docs_available = self._get_link_bases(index_url)
+			}  # there are more documents but these are the most useful, each one is only fetched when it is used
+			if raw is not None:
+				self._docs_available = self._load_raw(raw)
+			else:
+				self._docs_available = self._get_link_bases(index_url)
 		if not self._docs_available:
 			return
 		self._set_refs()
@@ -167,8 +281,9 @@ class Financials():
 			'cash_flows':self.cash_flows,
 			'income_statement':self.income_statement
 		}
-		with open("qreport.json", 'w') as f:
-			json.dump(self.documents, f, indent=3)
+		if dump:
+			with open("qreport.json", 'w') as f:
+				json.dump(self.documents, f, indent=3)
 		end = time.time()
 		del(self._documents)
 		print("One report takes {} seconds!".format(end-start))
@@ -177,18 +292,24 @@ class Financials():
 		#The other things are probably less important so i don't need to worry about the structure
 		return
 
-	def _get_soup(self, url):
-		req = urllib.request.urlopen(urllib.request.Request(url, headers={"User-Agent": self.u_agent()}))
-		soup = BeautifulSoup(str(req.read(), encoding='utf-8'), 'lxml')
+	@classmethod
+	def _get_soup(cls, url):
+		data = fetcher.fetch(url, headers={"User-Agent": cls.u_agent()})
+		soup = BeautifulSoup(data, 'lxml') #bytes go straight in, decoding to a str first is just another copy
 		return soup
 
-	def _get_link_bases(self, index_url):
-		soup = self._get_soup(index_url)
+	@classmethod
+	def _link_urls(cls, index_url):
+		'''
+		reads the filing's index page for where its linkbase documents are
+		:param index_url:
+		:return: DICT document name -> url, None if the filing has no XBRL
+		'''
+		soup = cls._get_soup(index_url)
 		xd_table = soup.find("table",{"class":"tableFile", "summary":"Data Files"})
 		if not xd_table:
 			print("There are no XBRL documents!")
-			self.defunt = True
-			return False
+			return None
 		# print(xd_table)
 		xrefs = xd_table.find_all("a")
 		xrefs = [x.parent.parent for x in xrefs]
@@ -208,32 +329,158 @@ class Financials():
 			elif "PRESENTATION" in desc or "PRE" in desc:
 				presentation_ref = ref
 
-		schema_link = base + schema_ref.find("a")["href"]
-		instance_link = base + instance_ref.find("a")["href"]
-		calculation_link = base + calc_ref.find("a")["href"]
-		presentation_link = base + presentation_ref.find("a")["href"]
-		self._documents["instance"] = self._get_soup(instance_link)
-		self._documents["schema"] = self._get_soup(schema_link)
-		self._documents["calculation"] = self._get_soup(calculation_link)
-		self._documents["presentation"] = self._get_soup(presentation_link)
+		return {
+			"instance": base + instance_ref.find("a")["href"],
+			"schema": base + schema_ref.find("a")["href"],
+			"calculation": base + calc_ref.find("a")["href"],
+			"presentation": base + presentation_ref.find("a")["href"]
+		}
+
+	@classmethod
+	def _download(cls, urls):
+		'''
+		downloads the documents all at once instead of one after the other, the rate limiter in fetcher still
+		decides how fast requests actually go out
+		:param urls: DICT document name -> url
+		:return: GENERATOR of (name, bytes) in the order the downloads finish
+		'''
+		with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+			downloads = {pool.submit(fetcher.fetch, urls[name], {"User-Agent": cls.u_agent()}): name for name in urls}
+			for done in as_completed(downloads):
+				yield downloads[done], done.result()
+
+	@classmethod
+	def fetch_raw(cls, index_url, names=None):
+		'''
+		downloads a filing's linkbase documents without parsing anything, hand the result to Financials(raw=...)
+		:param index_url:
+		:param names: LIST documents to get, the ones in needed if not given
+		:return: DICT document name -> bytes, empty if the filing has no XBRL
+		'''
+		urls = cls._link_urls(index_url)
+		if not urls:
+			return {}
+		names = names or cls.needed
+		return dict(cls._download({x: urls[x] for x in names}))
+
+	@classmethod
+	async def fetch(cls, index_url, engine='soup', executor=None):
+		'''
+		asyncio version of Financials(index_url). The documents of the filing are downloaded at the same time and the
+		parsing runs in executor (the loop's default thread pool if not given, a ProcessPoolExecutor works too) so the
+		event loop is never blocked
+		:return: Financials
+		'''
+		loop = asyncio.get_running_loop()
+		urls = await loop.run_in_executor(None, cls._link_urls, index_url)
+		raw = {}
+		if urls:
+			names = cls.needed
+			downloads = [loop.run_in_executor(None, fetcher.fetch, urls[x], {"User-Agent": cls.u_agent()}) for x in names]
+			raw = dict(zip(names, await asyncio.gather(*downloads)))
+		return await loop.run_in_executor(executor, functools.partial(cls, index_url, dump=False, engine=engine, raw=raw))
+
+	def _parse_document(self, name, data):
+		if name != "instance":
+			return BeautifulSoup(data, 'lxml')
+		if self._engine == 'stream':
+			return parse_instance(data)
+		return index_soup(BeautifulSoup(data, 'lxml'))
+
+	def _stream_instance(self, url):
+		'''
+		feeds the instance to the parser chunk by chunk as it comes off the network. If the download breaks partway
+		through it starts over with a plain fetch, which gets the rate limiter's retries like the other documents
+		:return: Instance
+		'''
+		parser = InstanceParser()
+		try:
+			for chunk in fetcher.fetch_stream(url, headers={"User-Agent": self.u_agent()}):
+				parser.feed(chunk)
+		except fetcher.StreamBroken as e:
+			print("{}, fetching it again".format(e))
+			return parse_instance(fetcher.fetch(url, headers={"User-Agent": self.u_agent()}, use_cache=False))
+		return parser.close()
+
+	def _load_raw(self, raw):
+		if not raw:
+			self._defunct = True
+			return False
+		for name in raw.keys():
+			self._documents[name] = self._parse_document(name, raw[name])
+		return True
+
+	def _get_link_bases(self, index_url):
+		self._links = self._link_urls(index_url)
+		if not self._links:
+			self._defunct = True
+			return False
+		names = list(self.needed)
+		streaming = None
+		if self._engine == 'stream' and 'instance' in names:
+			names.remove('instance')
+			streaming = ThreadPoolExecutor(max_workers=1)
+			instance = streaming.submit(self._stream_instance, self._links['instance'])
+		try:
+			for name, data in self._download({x: self._links[x] for x in names}):
+				self._documents[name] = self._parse_document(name, data)  # parse while the others are still coming in
+			if streaming:
+				self._documents['instance'] = instance.result()
+		finally:
+			if streaming:
+				streaming.shutdown()
 		return True
 
+	def _document(self, name):
+		'''
+		the parsed document, only downloaded the first time something asks for it if it wasn't one of the needed ones
+		:param name: STRING 'instance', 'schema', 'calculation' or 'presentation'
+		:return:
+		'''
+		if self._documents[name] is None:
+			if not self._links:
+				self._links = self._link_urls(self._index_url)
+			if name == 'instance' and self._engine == 'stream':
+				self._documents[name] = self._stream_instance(self._links[name])
+				return self._documents[name]
+			data = fetcher.fetch(self._links[name], headers={"User-Agent": self.u_agent()})
+			self._documents[name] = self._parse_document(name, data)
+		return self._documents[name]
+
 	def _set_refs(self):
 		'''
 		should use the references from the schema
 		:return:
 		'''
-		roles = self._documents["schema"].find_all("link:roletype")
+		roles = self._document("schema").find_all("link:roletype")
+		# companies keep the same roles filing after filing, so scoring a role usually is a lookup
+		scored = []
+		for role in roles:
+			definition = str(role.find(name='link:definition').text).lower()
+			role_key = (role.attrs['roleuri'], definition)
+			with self._role_scores_lock:
+				scores = self._role_scores.get(role_key)
+				if scores is not None:
+					self._role_scores.move_to_end(role_key)
+			if scores is None:
+				scores = {}
+				for key in self.statement_refs.keys():
+					if key == 'parenthetical':
+						scores[key] = self._pmatch(definition, self._keywords[key])
+					else:
+						scores[key] = self._matches(definition, self._keywords[key])
+				with self._role_scores_lock:
+					self._role_scores[role_key] = scores
+					while len(self._role_scores) > self._role_scores_size:
+						self._role_scores.popitem(last=False)
+			scored.append((role_key[0], scores))
 		for key in self.statement_refs.keys():
 			best = {'num_matches': 0, 'item': None}
-			for role in roles:
-				definition = str(role.find(name='link:definition').text).lower()
-				matches = self._matches(definition, self.statement_refs[key])
-				if key == 'parenthetical':
-					matches = self._pmatch(definition, self.statement_refs[key])
+			for role_uri, scores in scored:
+				matches = scores[key]
 				if matches > best['num_matches']:
 					best['num_matches'] = matches
-					best['item'] = role.attrs['roleuri']
+					best['item'] = role_uri
 			if key == 'balancesheet':
 				self._balance_sheet_ref = best['item']
 			elif key == 'cashflows':
@@ -282,56 +529,85 @@ class Financials():
 			if work[i].isupper():
 				return work[i:]
 
+	def _concept_name(self, label):
+		'''
+		turns an arc endpoint label like loc_us-gaap_AssetsCurrent_12AB into the concept name AssetsCurrent,
+		the same labels come up over and over within a report so the answers are kept for it
+		:param label:
+		:return:
+		'''
+		name = self._concept_names.get(label)
+		if name is None:
+			stuff = self.cleanse(label).split('_')
+			if len(stuff[0]) == 1:
+				name = stuff[1]
+			else:
+				name = stuff[0]
+			self._concept_names[label] = name
+		return name
+
+	def _arc_pairs(self, reference):
+		'''
+		:param reference: STRING role of the statement
+		:return: TUPLE of (from, to) concept names in the order the arcs come in, each pair only once
+		'''
+		links = self._document("calculation").find_all(re.compile("calculationlink"), {"xlink:role":reference})
+		pairs = []
+		seen = set()
+		for link in links:
+			for arc in link.find_all(re.compile("calculationarc")):
+				pair = (self._concept_name(arc["xlink:from"]), self._concept_name(arc["xlink:to"]))
+				if pair not in seen:
+					seen.add(pair)
+					pairs.append(pair)
+		return tuple(pairs)
+
 	def parse_arc(self, reference):
 		'''
 		should parse the calculation arcs and or presentation arcs to find the information and its structure
 		I can do a different kind of parse for statements that don't need to be structured
+
+		A company's filings nearly always have the same arcs quarter after quarter, so the flatlist is kept per role
+		and set of arcs and the next filing with the same ones gets a copy instead of walking the tree again
 		:return:
 		'''
-		def xto(tag):
-			return tag["xlink:to"]
-		def xfrom(tag):
-			return tag["xlink:from"]
+		pairs = self._arc_pairs(reference)
+		key = (reference, pairs, reference == self._balance_sheet_ref)
+		with self._structures_lock:
+			cached = self._structures.get(key)
+			if cached:
+				self._structures.move_to_end(key)
+		if cached:
+			flat_list, missing = cached
+			if missing:
+				self._missing_liabilities = True
+		else:
+			flat_list = self._flatten(reference, pairs)
+			missing = key[2] and 'Liabilities' not in [x for pair in pairs for x in pair]
+			with self._structures_lock:
+				self._structures[key] = (flat_list, missing)
+				while len(self._structures) > self._structures_size:
+					self._structures.popitem(last=False)
+		# everybody gets their own copy, the entries end up in the report and could be changed there
+		return [dict(x, path=list(x['path']), words=list(x['words'])) for x in flat_list]
+
+	def _flatten(self, reference, pairs):
 		def brackets(s):
 			return '[\'' + s + '\']'
-		def gaap_split(s):
-			stuff = s.split('_')
-			if len(stuff[0]) == 1:
-				return stuff[1]
-			else:
-				return stuff[0]
 
-		links = self._documents["calculation"].find_all(re.compile("calculationlink"), {"xlink:role":reference})
-		arcs = []
-		for link in links:
-			larcs = link.find_all(re.compile("calculationarc"))
-			for arc in larcs:
-				arcs.append(arc)
-		# arcs = link.find_all(re.compile("calculationarc")) #gets all of the calc arcs
+		# one pass over the arcs builds both directions of the graph
 		statement_items = []
-		for arc in arcs:
-			fro = gaap_split(self.cleanse(xfrom(arc)))
-			to = gaap_split(self.cleanse(xto(arc)))
-			statement_items.append(fro)
-			statement_items.append(to)
-		statement_items = list(set(statement_items))
-
 		new = {}
-		for item in statement_items:
-			new[item] = {'to': [], 'from': []}
-
-		for item in statement_items:
-			for arc in arcs:
-				fro = gaap_split(self.cleanse(xfrom(arc)))
-				t = gaap_split(self.cleanse(xto(arc)))
-				if item == fro:
-					new[item]['to'].append(t)
-				elif item == t:
-					new[item]['from'].append(fro)
-			new[item]['from'] = list(set(new[item]['from']))
-			new[item]['to'] = list(set(new[item]['to']))
-
-		if 'Liabilities' not in statement_items and reference == self._balance_sheet_ref:
+		for fro, to in pairs:
+			for item in (fro, to):
+				if item not in new:
+					new[item] = {'to': [], 'from': []}
+					statement_items.append(item)
+			new[fro]['to'].append(to)
+			if fro != to:
+				new[to]['from'].append(fro)
+
+		if 'Liabilities' not in new and reference == self._balance_sheet_ref:
 			# do something here
 			'''
             I thought about doing something with the root addresses, however it would really be easier to
@@ -354,64 +630,54 @@ class Financials():
 			new["LiabilitiesAndStockholdersEquity"]['to'] = [x for x in new["LiabilitiesAndStockholdersEquity"]['to'] if x not in valid]
 			new['Liabilities']['to'] = valid
 
-		items_copy = statement_items.copy()
-		level_items = {}
-		level = 0
+		remaining = set(statement_items)
+		visited = set()
 		flat_list = []
-
-		while len(items_copy) > 0:
-			level_items[str(level)] = []
-			if level == 0:
-				used = []
-				for key in items_copy:
-					if len(new[key]['from']) == 0:
-						i_tup = (key, new[key], brackets(key))
-						l_item = {
-							"level":level,
-							"key":brackets(key),
-							"words":self._camel_case(key),
-							"search":key
-						}
-						flat_list.append(l_item)
-						level_items[str(level)].append(i_tup)
-						used.append(key)
-				for item in used:
-					items_copy.remove(item)
-				level += 1
-			else:
-				parents = level_items[str(level - 1)]  # list of tuples
-				child_lists = []
-				used = []
-				for parent in parents:
-					child_lists.append(parent[1]['to'])
-				for i in range(0, len(child_lists)):
-					child_list = child_lists[i]
-					parent_address = parents[i][2]
-					for child in child_list:
-						child_address = parent_address + '''['items']''' + brackets(child)
-						c_tup = (child, new[child], child_address)
-						level_items[str(level)].append(c_tup)
-						l_item = {
-							"level":level,
-							"key":child_address,
-							"words":self._camel_case(child),
-							"search":child
-						}
-						flat_list.append(l_item)
-						used.append(child)
-				for item in used:
-					if item in items_copy:
-						items_copy.remove(item)
-				level += 1
+		parents = []  # list of tuples (item, address, path)
+		for key in statement_items:
+			if len(new[key]['from']) == 0:
+				l_item = {
+					"level":0,
+					"key":brackets(key),
+					"path":[key],
+					"words":self._camel_case(key),
+					"search":key
+				}
+				flat_list.append(l_item)
+				parents.append((key, brackets(key), [key]))
+				remaining.discard(key)
+				visited.add(key)
+		level = 1
+		while len(remaining) > 0 and len(parents) > 0:
+			children = []
+			found = False
+			for parent, parent_address, parent_path in parents:
+				for child in new[parent]['to']:
+					child_address = parent_address + '''['items']''' + brackets(child)
+					child_path = parent_path + [child]
+					l_item = {
+						"level":level,
+						"key":child_address,
+						"path":child_path,
+						"words":self._camel_case(child),
+						"search":child
+					}
+					flat_list.append(l_item)
+					children.append((child, child_address, child_path))
+					remaining.discard(child)
+					if child not in visited:
+						visited.add(child)
+						found = True
+			if not found:
+				break  # nothing new below here, only a cycle in the arcs could keep this going
+			parents = children
+			level += 1
 		return flat_list
 
 	def _table_format(self, statement, s_base):
-		def new_item():
-			return {'items': {}, 'value': None}
 		statement['table'] = {}
-		base = 'self.' + s_base + '''['table']'''
 		for item in statement['flatlist']:
-			exec('{}{} = new_item()'.format(base, item['key']))
+			table_node(statement['table'], item['path'], create=True)
 		return
 
 	# def _get_context(self, statement_flatlist):
@@ -451,51 +717,34 @@ class Financials():
 	# 	return ctexts[max_index]['id']
 
 	def _get_context(self, statement_flatlist, statement_type):
-		d_pattern = None
+		'''
+		Picks the context to read a statement's values from, the first item on the statement that has values outside
+		of any dimension decides it, and the latest of its contexts wins
+		:param statement_flatlist:
+		:param statement_type:
+		:return: STRING id of the context
+		'''
 		has_instant = ['balance_sheet',
 					   'parenthetical']
 		has_range = ['cash_flows',
 					 'income_statement']
+		instance = self._document('instance')
 		if statement_type in has_instant:
-			d_pattern = re.compile("instant")
+			usable = instance.undimensioned('instant')
+			period = 'instant'
 		elif statement_type in has_range:
-			d_pattern = re.compile("startdate")
+			usable = instance.undimensioned('duration')
+			period = 'start'
 		else:
 			return None
-		def _remove_bad(ctexts):
-			stuff = ctexts
-			remove_these = []
-			for ctex in ctexts:
-				context = self._documents['instance'].find(re.compile("context"), {"id":ctex})
-				if context.find(re.compile("segment")):
-					remove_these.append(ctex)
-				elif context.find(re.compile("enddate")) and statement_type in has_instant:
-					remove_these.append(ctex)
-				elif context.find(re.compile("instant")) and statement_type in has_range:
-					remove_these.append(ctex)
-				else:
-					continue
-			for bad_item in remove_these:
-				stuff.remove(bad_item)
-			return stuff
-		def _dfroms(dstring):
-			y, m, d = [int(x) for x in dstring.split(sep='-')]
-			return datetime.date(y, m, d)
 
 		for i in range(0, len(statement_flatlist)):
-			inspect = statement_flatlist[i]['search'].lower()[0:90] #needs to be cutoff for regex
-			items = self._documents['instance'].find_all(re.compile(inspect))
-			ctexts = [x['contextref'] for x in items]
-			ctexts = list(set(ctexts)) #eliminate duplicates
-			ctexts = _remove_bad(ctexts)
+			ctexts = [x for x in instance.facts.get(statement_flatlist[i]['search'].lower(), {}) if x in usable]
 			if len(ctexts) == 0:
 				continue
 			else:
 				break
-		ctexts = [self._documents['instance'].find(re.compile("context"), {"id":x}) for x in ctexts]
-		dates = [_dfroms(x.find(d_pattern).text) for x in ctexts]
-		m_ind = dates.index(max(dates))
-		return ctexts[m_ind]['id']
+		return max(ctexts, key=lambda x: getattr(instance.contexts[x], period))
 
 
 
@@ -557,24 +806,13 @@ class Financials():
 
 
 	def load(self, statement, s_base, ctex):
-		base = 'self.' + s_base + '''['table']'''
+		facts = self._document('instance').facts
 		for item in statement['flatlist']:
-			s_item = item['search'].lower()[0:90]
-			# print(s_item)
-			# print(ctex)
-			val = self._documents['instance'].find_all(re.compile(":" + s_item), {"contextref":ctex})
-			if not val:
-				# print(json.dumps([item, s_item, ctex], indent=2))
-				pass
-			else:
-				names = [len(v.name) for v in val]
-				good_ind = names.index(min(names))
-				val = val[good_ind]
-				val = val.text
-			if not val:
+			fact = facts.get(item['search'].lower(), {}).get(ctex)
+			val = number(fact[0]) if fact and fact[0] else None
+			if val is None:
 				continue
-			exec_string = base + item['key'] + '''['value']''' + " = " + "{}".format(val)
-			exec(exec_string)
+			table_node(statement['table'], item['path'])['value'] = val
 
 	# def search(self, statement, words, level=None):
 	# 	'''
@@ -630,7 +868,6 @@ class Financials():
 		if statement not in self.documents.keys():
 			return None
 		else:
-			base = "self.documents[\'{}\']".format(statement) + '''['table']'''
 			search_pool = self.documents[statement]['flatlist']
 			hits = {}
 			for entry in search_pool:
@@ -644,12 +881,12 @@ class Financials():
 						hits[k] = []
 					hits[k].append((entry, matches))
 			#now write some logic for what to return
-			best = {"matches": 0, 'key': None}
+			best = {"matches": 0, 'entry': None}
 			if not level:
 				for k in hits.keys():
 					for entry in hits[k]:
 						if entry[1] > best['matches']:
-							best['key'] = entry[0]['key']
+							best['entry'] = entry[0]
 							best['matches'] = entry[1]
 			else:
 				use = level
@@ -664,12 +901,20 @@ class Financials():
 						use = level
 				for entry in hits[use]:
 					if entry[1] > best['matches']:
-						best['key'] = entry[0]['key']
+						best['entry'] = entry[0]
 						best['matches'] = entry[1]
-		val = best['key']
-		eval_string = base + val
-		return(eval(eval_string))
+		if not best['entry']:
+			return None
+		return table_node(self.documents[statement]['table'], entry_path(best['entry']))
+
 
+def build_documents(index_url, raw, engine='soup'):
+	'''
+	builds a filing's tables from the documents Financials.fetch_raw downloaded, it's a plain function so it can be
+	handed to a process pool
+	:return: DICT the statements, None if the filing had no XBRL
+	'''
+	return Financials(index_url, dump=False, engine=engine, raw=raw).documents
 
 def p(l):
 	print(json.dumps(l, indent=3))
@@ -4,30 +4,108 @@ import glob
 from bs4 import BeautifulSoup
 import re
 import json
-from urllib.request import urlopen
-import urllib.request
 import pandas
 import os
 import copy
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import time
 from multiprocessing import Process
 from datetime import date
 import datetime
+import calendar
 import random
-from reports_getter import Financials
+import operator
+import asyncio
+import functools
+from collections import OrderedDict
+from reports_getter import Financials, table_node, entry_path, build_documents, WordIndex
+import fetcher
 import matplotlib.pyplot as plt
 import numpy as np
 import matplotlib.dates as mdates
 import matplotlib.ticker as ticker
 usg = re.compile("us-gaap:*")
 
+class TickerIndex():
+    '''
+    Ticker -> CIK and issuer name out of SEC's company_tickers.json kept on disk, so finding a CIK is a dictionary
+    lookup instead of scraping a browse page. The file looks like
+    {"0": {"cik_str": 320193, "ticker": "AAPL", "title": "Apple Inc."}, ...}
+    company_tickers_exchange.json ({"fields": [...], "data": [[cik, name, ticker, exchange], ...]}) works too.
+    '''
+    url = "https://www.sec.gov/files/company_tickers.json"
+
+    def __init__(self, path="company_tickers.json"):
+        self.path = path
+        self._tickers = None
+
+    def _fill(self, mapping):
+        tickers = {}
+        if 'fields' in mapping:
+            fields = mapping['fields']
+            rows = [dict(zip(fields, row)) for row in mapping['data']]
+            rows = [{'cik_str': x['cik'], 'ticker': x['ticker'], 'title': x['name']} for x in rows]
+        else:
+            rows = mapping.values()
+        for row in rows:
+            if not row['ticker']:
+                continue
+            tickers[row['ticker'].upper()] = (str(row['cik_str']).zfill(10), row['title'])
+        self._tickers = tickers
+
+    def load(self, path=None):
+        with open(path or self.path, 'r') as f:
+            self._fill(json.load(f))
+
+    def refresh(self):
+        '''
+        downloads a fresh copy of the mapping and saves it to self.path
+        :return:
+        '''
+        data = fetcher.fetch(self.url, headers={"User-Agent": random.choice(DataGrabber.u_agents)}, use_cache=False)
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        self._fill(json.loads(data))
+
+    def lookup(self, ticker):
+        '''
+        :param ticker: STRING
+        :return: TUPLE (cik, issuer name) with the cik padded to 10 digits, None if the ticker isn't known
+        '''
+        if self._tickers is None:
+            if not os.path.exists(self.path):
+                return None
+            self.load()
+        return self._tickers.get(ticker.upper())
+
+
 class DataGrabber():
     '''
     This is good so far but perhaps not complete. I don't know what effect restricted stock has,
     the addition of the user-agent workaround should allow me to pull files when I need and avoid 403
     '''
 
+    query_cache_size = 1024  # how many timespan series a DataGrabber remembers
+
+    # the different concept names companies use for the same thing, the first one a statement has is used. Add to it
+    # or change it as needed, a name that isn't in here is looked up as a concept name
+    concept_aliases = {
+        'cash': ['CashAndCashEquivalentsAtCarryingValue', 'CashAndEquivalentsAtCarryingValue', 'Cash'],
+        'short_term_investments': ['ShortTermInvestments', 'MarketableSecuritiesCurrent', 'AvailableForSaleSecuritiesDebtSecuritiesCurrent'],
+        'receivables': ['AccountsReceivableNetCurrent', 'ReceivablesNetCurrent'],
+        'current_assets': ['AssetsCurrent'],
+        'assets': ['Assets'],
+        'accounts_payable': ['AccountsPayableCurrent', 'AccountsPayableAndAccruedLiabilitiesCurrent'],
+        'current_liabilities': ['LiabilitiesCurrent'],
+        'liabilities': ['Liabilities'],
+        'stockholders_equity': ['StockholdersEquity', 'StockholdersEquityIncludingPortionAttributableToNoncontrollingInterest'],
+        'revenue': ['Revenues', 'RevenueFromContractWithCustomerExcludingAssessedTax', 'SalesRevenueNet'],
+        'operating_income': ['OperatingIncomeLoss'],
+        'net_income': ['NetIncomeLoss', 'ProfitLoss'],
+        'operating_cash_flow': ['NetCashProvidedByUsedInOperatingActivities', 'NetCashProvidedByUsedInOperatingActivitiesContinuingOperations']
+    }
+
     #some randomly generated user agents to be used at random when doing HTTP requests.
     u_agents = ["Mozilla/5.0 (Windows; U; Windows NT 6.2) AppleWebKit/532.25.3 (KHTML, like Gecko) Version/5.0.3 Safari/532.25.3",
                 "Mozilla/5.0 (Macintosh; U; PPC Mac OS X 10_7_9 rv:3.0; en-US) AppleWebKit/534.32.7 (KHTML, like Gecko) Version/5.0.4 Safari/534.32.7",
@@ -39,51 +117,281 @@ class DataGrabber():
     def u_agent(self):
         return random.choice(self.u_agents)
 
+    def _get_soup(self, url, use_cache=True):
+        data = fetcher.fetch(url, headers={"User-Agent": self.u_agent()}, use_cache=use_cache)
+        return BeautifulSoup(data, 'lxml')
+
     def _date_from_string(self, s):
         ymd = s.split(sep='-')
         ymd = [int(x) for x in ymd]
         return datetime.date(ymd[0], ymd[1], ymd[2])
 
-    def __init__(self, ticker, file=False):
-        self._issuer_name = ""
-        self._cik_number = self._get_cik(ticker)
+    def __init__(self, ticker, file=False, workers=4, update=False, lazy=False, parse_workers=None, engine='soup'):
+        '''
+        :param ticker: STRING ticker of the company
+        :param file: BOOL load the reports from {ticker}_financials.json instead of fetching them, this never goes to the network
+        :param workers: INT most filings to fetch and parse at the same time, 1 fetches them one after the other
+        :param update: BOOL load {ticker}_financials.json and only fetch the filings that came out after the newest one in it,
+        without the file every filing is fetched like a new ticker
+        :param lazy: BOOL only find the filings, leave fetching them to iter_reports
+        :param parse_workers: INT processes to parse filings on, the worker threads then only download. None parses on
+        the worker threads
+        :param engine: STRING how Financials reads the instance documents, 'stream' parses them as they download
+        '''
+        self._ticker = ticker
+        self._issuer_name = None
+        self._cik_number = None  # looked up the first time something needs it, see cik_number
+        self._workers = workers
+        self._lazy = lazy
+        self._parse_workers = parse_workers
+        self._engine = engine
+        self._word_indexes = {}  # id of a flatlist -> (flatlist, WordIndex), see _word_index
+        self._queries = OrderedDict()  # remembered timespan series, see _series
+        self._version = 0  # goes up every time the reports change
 
         # self._insider_filings = self._get_insiders()
         # self._get_insider_holdings()
 
-        #will add some functionality later for updating the database of a company instead of searching for everything
-        if file:
-            with open("{}_financials.json".format(ticker) ,'r') as f:
-                self.reports = json.load(f)
-        else:
+        if update:
+            try:
+                self._load()
+            except FileNotFoundError:
+                print("Nothing saved for {} yet, fetching everything".format(ticker))
+                self.reports = []
+        elif file:
+            self._load()
+        if update:
+            self._update()
+        elif not file:
             self._day = datetime.date.today()
-            self._cutoff = datetime.date(self._day.year - 5, self._day.month - 1, self._day.day)  # cutoff date for grabbing reports
+            self._cutoff = self._default_cutoff()  # cutoff date for grabbing reports
             self.reports = self._get_reports()  # collects the indexes of 10-k and 10-Q reports for a quarterly look a financials
             # print(json.dumps(self.reports, indent=2))
-            self._fill_reports()
+            if not lazy:
+                self._fill_reports()
 
         # print(json.dumps(self._reports, indent=1))
 
         # with open("{}_holdings.json".format(ticker), 'w') as f:
         #     f.write(json.dumps(self._insider_filings, indent=2))
 
-        if not file:
-            with open("{}_financials.json".format(ticker), 'w') as f:
-                json.dump(self.reports, f, indent=2)
+        if (update or not file) and not lazy:
+            self.save()
         # self._print()
         self._sort_reports()
 
-    def _fill_reports(self):
-        remove = []
-        for report in self.reports:
+    @property
+    def cik_number(self):
+        if self._cik_number is None:
+            self._cik_number = self._get_cik(self._ticker)
+        return self._cik_number
+
+    @property
+    def issuer_name(self):
+        if self._issuer_name is None:
+            self._cik_number = self._get_cik(self._ticker)
+        return self._issuer_name
+
+    def _file_name(self):
+        return "{}_financials.json".format(self._ticker)
+
+    def _load(self):
+        '''
+        reads the reports saved by save(), nothing here touches the network
+        :return:
+        '''
+        with open(self._file_name(), 'r') as f:
+            saved = json.load(f)
+        if isinstance(saved, list):
+            self.reports = saved  # saved before the cik was kept with the reports, it gets looked up if it's needed
+        else:
+            self._cik_number = saved['cik']
+            self._issuer_name = saved['issuer']
+            self.reports = saved['reports']
+        self.reports_changed()
+
+    def save(self):
+        saved = {
+            'ticker': self._ticker,
+            'cik': self._cik_number,
+            'issuer': self._issuer_name,
+            'reports': self.reports
+        }
+        with open(self._file_name(), 'w') as f:
+            json.dump(saved, f, indent=2)
+
+    def _fetch_financials(self, report):
+        print("Fetching data from: {}".format(report['index']))
+        report['data'] = Financials(report['index'], dump=False, engine=self._engine).documents
+        return report
+
+    def _start_filling(self, reports):
+        '''
+        Starts fetching and parsing the filings on a pool of worker threads, each report gets its data as soon as its
+        filing is done instead of waiting on the ones before it
+        :param reports: LIST reports to fill
+        :return: GENERATOR the same reports in the same order, each one as soon as it's been filled
+        '''
+        if self._parse_workers:
+            return self._start_pipeline(reports)
+        pool = ThreadPoolExecutor(max_workers=self._workers)
+        jobs = [pool.submit(self._fetch_financials, report) for report in reports]
+        def results():
+            try:
+                for job in jobs:
+                    yield job.result()
+            finally:
+                pool.shutdown(cancel_futures=True)
+        return results()
+
+    def _start_pipeline(self, reports):
+        '''
+        Same as _start_filling but in two stages. Parsing holds the GIL, so threads only do the downloading and hand the
+        raw documents to a pool of processes that builds the tables, which lets parsing use every core
+        :param reports: LIST reports to fill
+        :return: GENERATOR the same reports in the same order, each one as soon as it's been filled
+        '''
+        fetchers = ThreadPoolExecutor(max_workers=self._workers)
+        parsers = ProcessPoolExecutor(max_workers=self._parse_workers)
+
+        def fetch(report):
             print("Fetching data from: {}".format(report['index']))
-            rep = Financials(report['index'])
-            if not rep.documents:
-                remove.append(report)
-            else:
-                report['data'] = Financials(report['index']).documents
+            raw = Financials.fetch_raw(report['index'])
+            job = parsers.submit(build_documents, report['index'], raw, self._engine)
+            def fill(done):
+                if not done.cancelled() and not done.exception():
+                    report['data'] = done.result()
+            job.add_done_callback(fill)
+            return job
+
+        jobs = [fetchers.submit(fetch, report) for report in reports]
+        def results():
+            try:
+                for report, job in zip(reports, jobs):
+                    report['data'] = job.result().result()
+                    yield report
+            finally:
+                fetchers.shutdown(cancel_futures=True)
+                parsers.shutdown(cancel_futures=True)
+        return results()
+
+    def _fill_reports(self, reports=None):
+        '''
+        :param reports: LIST reports to fill, all of them if not given. Ones without XBRL data are taken out of it
+        :return:
+        '''
+        if reports is None:
+            reports = self.reports
+        remove = [x for x in self._start_filling(reports) if not x['data']]
         for bad_report in remove:
-            self.reports.remove(bad_report)
+            reports.remove(bad_report)
+        self.reports_changed()
+
+    def iter_reports(self):
+        '''
+        Yields the reports newest first, each one as soon as it is ready instead of after every filing is done like the
+        constructor does. Reports that already have their data come back straight away, the rest are fetched in the
+        background. Filings without XBRL data are dropped, and the reports get saved once everything has been fetched.
+        :return: GENERATOR of report dicts
+        '''
+        self._sort_reports()
+        reports = list(self.reports)
+        missing = [x for x in reports if x['data'] is None]
+        if not missing:
+            yield from reports
+            return
+        waiting = set([id(x) for x in missing])  # their data gets filled in behind our back so check by identity
+        filled = self._start_filling(missing)
+        for report in reports:
+            if id(report) in waiting:
+                report = next(filled)
+                self.reports_changed()
+                if not report['data']:
+                    self.reports.remove(report)
+                    continue
+            yield report
+        self.save()
+
+    @classmethod
+    async def create(cls, ticker, **kwargs):
+        '''
+        asyncio way to make a DataGrabber, finds the filings off the event loop and leaves fetching them to aiter_reports
+        :param ticker:
+        :param kwargs: anything else the constructor takes
+        :return: DataGrabber
+        '''
+        kwargs['lazy'] = True
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(cls, ticker, **kwargs))
+
+    async def aiter_reports(self, executor=None):
+        '''
+        asyncio version of iter_reports, use it with async for. Up to self._workers filings are fetched at a time,
+        each with its documents downloaded together, and the parsing runs in executor
+        :param executor: where to parse, the loop's default thread pool if not given
+        :return: ASYNC GENERATOR of report dicts, newest first
+        '''
+        self._sort_reports()
+        reports = list(self.reports)
+        slots = asyncio.Semaphore(self._workers)
+
+        async def fill(report):
+            async with slots:
+                print("Fetching data from: {}".format(report['index']))
+                rep = await Financials.fetch(report['index'], engine=self._engine, executor=executor)
+            report['data'] = rep.documents
+            return report
+
+        tasks = {id(x): asyncio.ensure_future(fill(x)) for x in reports if x['data'] is None}
+        try:
+            for report in reports:
+                if id(report) in tasks:
+                    report = await tasks[id(report)]
+                    self.reports_changed()
+                    if not report['data']:
+                        self.reports.remove(report)
+                        continue
+                yield report
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        if tasks:
+            await asyncio.get_running_loop().run_in_executor(None, self.save)
+
+    def _update(self):
+        '''
+        Asks EDGAR for the filings that came out since the newest saved report and adds just those
+        :return:
+        '''
+        self._day = datetime.date.today()
+        if self.reports:
+            latest = max([self._date_from_string(x['date']) for x in self.reports])
+            self._cutoff = latest - datetime.timedelta(days=1)  # a day early in case two came out together
+        else:
+            self._cutoff = self._default_cutoff()
+        known = set([x['index'] for x in self.reports])
+        new = [x for x in self._get_reports(use_cache=False) if x['index'] not in known]
+        if not new:
+            print("No new filings since {}".format(self._cutoff))
+            return
+        if not self._lazy:
+            self._fill_reports(new)
+        self.reports.extend(new)
+        self.reports_changed()
+
+    def _default_cutoff(self):
+        '''
+        how far back to go when nothing has been saved yet, five years and a month before self._day. The day is pulled
+        back to the end of the month when that month is shorter, Mar 31 goes to Feb 28 or 29
+        :return: date
+        '''
+        year = self._day.year - 5
+        month = self._day.month - 1
+        if month == 0:
+            year -= 1
+            month = 12
+        day = min(self._day.day, calendar.monthrange(year, month)[1])
+        return datetime.date(year, month, day)
 
     def _pick_after_cutoff(self, index_list, t):
         def date_of(res):
@@ -108,25 +416,36 @@ class DataGrabber():
         def dfroms(s):
             y, m, d = [int(x) for x in s.split(sep='-')]
             return datetime.date(y, m, d)
+        order = [id(x) for x in self.reports]
         self.reports.sort(key=lambda x: dfroms(x['date']), reverse=True)
+        if order != [id(x) for x in self.reports]:
+            self.reports_changed()  # record numbers mean different reports now
         return
 
-    def _get_reports(self):
+    def reports_changed(self):
+        '''
+        Forgets the remembered timespan series. Everything here that adds, drops, fills or reorders reports calls
+        this, call it yourself after changing self.reports by hand
+        :return:
+        '''
+        self._version += 1
+        self._queries.clear()
+        self._word_indexes.clear()
+
+    def _get_reports(self, use_cache=True):
         '''
         get the links for the 10-Q and 10-K reports all the way back to a given cutoff date
+        :param use_cache: BOOL False skips the cached browse pages to be sure of seeing the latest filings
         :return:
         '''
         def dfroms(s):
             y, m, d = [int(x) for x in s.split(sep='-')]
             return datetime.date(y, m, d)
 
-        qbase = "https://www.sec.gov/cgi-bin/browse-edgar?action=getcompany&CIK={}&type=10-Q&dateb=&owner=exclude&count=40&search_text=".format(self._cik_number)
-        kbase = "https://www.sec.gov/cgi-bin/browse-edgar?action=getcompany&CIK={}&type=10-K&dateb=&owner=exclude&count=40&search_text=".format(self._cik_number)
-        qreq = urlopen(urllib.request.Request(qbase, headers={"User-Agent": self.u_agent()}))
-        qsoup = BeautifulSoup(str(qreq.read(), encoding='utf-8'), 'lxml')
-
-        kreq = urlopen(urllib.request.Request(kbase, headers={"User-Agent": self.u_agent()}))
-        ksoup = BeautifulSoup(str(kreq.read(), encoding='utf-8'), 'lxml')
+        qbase = "https://www.sec.gov/cgi-bin/browse-edgar?action=getcompany&CIK={}&type=10-Q&dateb=&owner=exclude&count=40&search_text=".format(self.cik_number)
+        kbase = "https://www.sec.gov/cgi-bin/browse-edgar?action=getcompany&CIK={}&type=10-K&dateb=&owner=exclude&count=40&search_text=".format(self.cik_number)
+        qsoup = self._get_soup(qbase, use_cache=use_cache)
+        ksoup = self._get_soup(kbase, use_cache=use_cache)
 
         a_pattern = re.compile(r'/Archives/')
         q_ind = qsoup.find_all("a", {"href":a_pattern})
@@ -141,23 +460,27 @@ class DataGrabber():
 
 
     def _print(self):
-        print("CIK: {}".format(self._cik_number))
+        print("CIK: {}".format(self.cik_number))
         for filing in self._insider_filings:
             print(filing)
 
     def _get_cik(self, ticker):
         '''
-        gets the cik number from the ticker!
+        gets the cik number from the ticker! the local ticker index is tried first, the browse page is only
+        scraped for tickers it doesn't know
         :param ticker:
         :return:
         '''
+        found = tickers.lookup(ticker)
+        if found:
+            self._issuer_name = found[1]
+            return found[0]
         searchurl = "http://www.sec.gov/cgi-bin/browse-edgar?" + "action=getcompany&"
         full = searchurl + "CIK={}".format(ticker)
         # with open("website.txt", mode='r') as f:
         #     req = f.read()
         # print(full)
-        req = urlopen(urllib.request.Request(full, headers={"User-Agent":self.u_agent()})) #do this to get around 403
-        soup = BeautifulSoup(str(req.read(), encoding='utf-8'), 'lxml')
+        soup = self._get_soup(full) #the user agent gets around 403
         span = soup.find("span", {"class":"companyName"})
         self._issuer_name = span.text[0:-43]
         cikurl = span.find("a")
@@ -170,9 +493,8 @@ class DataGrabber():
         gets a list of CIK numbers and hrefs linked to the large holders of company
         :return:
         '''
-        url = "https://www.sec.gov/cgi-bin/own-disp?" + "action=getissuer&" + "CIK={}".format(self._cik_number)
-        req = urlopen(urllib.request.Request(url, headers={"User-Agent":self.u_agent()}))
-        soup = BeautifulSoup(str(req.read(), encoding='utf-8'), 'lxml')
+        url = "https://www.sec.gov/cgi-bin/own-disp?" + "action=getissuer&" + "CIK={}".format(self.cik_number)
+        soup = self._get_soup(url)
         rows = soup.find_all("a", {'href':re.compile(r'getowner')})
         issuer_cik = []
         for row in rows:
@@ -197,8 +519,7 @@ class DataGrabber():
             print(json.dumps(holder["history"], indent=2))
 
     def _get_history(self, url):
-        req = urlopen(urllib.request.Request(url, headers={"User-Agent": self.u_agent()}))
-        soup = BeautifulSoup(str(req.read(), encoding='utf-8'), 'lxml')
+        soup = self._get_soup(url)
         refs = soup.find_all("a", {'href': re.compile(r'/Archives/')})
         na = "N/A"
         history = []
@@ -234,16 +555,14 @@ class DataGrabber():
                     return False
 
         na = "N/A"
-        req = urlopen(urllib.request.Request(url, headers={"User-Agent": self.u_agent()}))
-        soup1 = BeautifulSoup(str(req.read(), encoding='utf-8'), 'lxml')
+        soup1 = self._get_soup(url)
         ref = soup1.find("a", text=re.compile(r'.xml'))
         xml_doc = "https://www.sec.gov" + ref['href']
 
-        req = urlopen(urllib.request.Request(xml_doc, headers={"User-Agent": self.u_agent()}))
-        soup = BeautifulSoup(str(req.read(), encoding='utf-8'), 'lxml')
+        soup = self._get_soup(xml_doc)
         if(soup.find("issuername") == None):
             return
-        if (soup.find("issuername").text != self._issuer_name):
+        if (soup.find("issuername").text != self.issuer_name):
             return
         #maybe don't use the note for now
         print("---------{}---------".format(xml_doc))
@@ -293,21 +612,37 @@ class DataGrabber():
             }
         history.append(f4)
 
-    def search(self, statement, record, terms, level=None, exclude=None):
+    def _word_index(self, flatlist):
+        '''
+        the WordIndex of a statement's flatlist, built the first time that statement gets searched. The flatlist is
+        kept alongside so its id can't be handed to another list while the index is still around
+        '''
+        cached = self._word_indexes.get(id(flatlist))
+        if cached is None or cached[0] is not flatlist:
+            cached = (flatlist, WordIndex(flatlist))
+            self._word_indexes[id(flatlist)] = cached
+        return cached[1]
+
+    def _under(self, index, parent):
+        '''
+        :param parent: STRING a name from concept_aliases or a concept name
+        :return: SET ids of everything below any entry that is parent
+        '''
+        tops = set()
+        for name in self.concept_aliases.get(parent, [parent]):
+            tops.update(index.concepts.get(name.lower(), ()))
+        return index.below(tops)
+
+    def search(self, statement, record, terms, level=None, exclude=None, parent=None):
         '''
         :param statement: STRING ['balance_sheet', 'cash_flows', 'income_statement']
         :param terms: LIST words to try matching
         :param level: INT level, enforce more specific or less specific entry (useful for finding entries on tables with structure)
         :param exclude: LIST if words are given in exclude, then a match against one of these will force an entry not to match
+        :param parent: STRING only look at the items under this one, a concept name like 'LiabilitiesCurrent' or a
+        name from concept_aliases
         :return:
         '''
-
-        def l_matches(w_list1, w_list2):
-            matches = 0
-            for word in w_list1:
-                if word in w_list2:
-                    matches += 1
-            return matches
         statements = [
             'balance_sheet',
             'cash_flows',
@@ -315,68 +650,148 @@ class DataGrabber():
         ]
         if statement not in statements:
             return None
+        data = self.reports[record]['data']
+        if data is None:
+            return None  # still being fetched, see lazy and iter_reports
+        base = data[statement]['table']
+        index = self._word_index(data[statement]['flatlist'])
+        within = None
+        if parent:
+            within = self._under(index, parent)
+            if not within:
+                return None
+
+        # most matches wins, on a tie the one that comes first in the flatlist
+        def best(ids):
+            i = min(ids, key=lambda x: (-scores[x], x))
+            return table_node(base, entry_path(index.entries[i]))
+
+        if level and level in index.levels:
+            # only the entries on that level get looked at, the rest only matter if none of them match
+            on_level = index.levels[level]
+            if within is not None:
+                on_level = on_level & within
+            scores = index.scores(terms, exclude, within=on_level)
+            if scores:
+                return best(scores.keys())
+        scores = index.scores(terms, exclude, within=within)
+        if not scores:
+            return None
+        if not level:
+            return best(scores.keys())
+
+        hits = {}  # level -> ids of the entries that matched on it, none of them on the level asked for
+        for i in scores.keys():
+            hits.setdefault(int(index.entries[i]['level']), []).append(i)
+        lv_list = list(hits.keys())
+        lv_list.sort()
+        if level <= 0:
+            use = lv_list[0]
+        elif level > len(lv_list) - 1:
+            use = lv_list[-1]
         else:
-            base_str = "self.reports[{}]".format(record) + '''['data']''' +"[\'{}\']".format(statement) + '''['table']'''
-            search_pool_str = "self.reports[{}]".format(record) + '''['data']''' +"[\'{}\']".format(statement) + '''['flatlist']'''
-
-            base = self.reports[record]['data'][statement]['table']
-            search_pool = self.reports[record]['data'][statement]['flatlist']
-
-            hits = {}
-            for entry in search_pool:
-                matches = l_matches(terms, entry['words'])
-                restricted = None
-                if exclude:
-                    restricted = l_matches(entry['words'], exclude)
-                if matches and not restricted:
-                    k = int(entry['level'])
-                    if k not in hits.keys():
-                        hits[k] = []
-                    hits[k].append((entry, matches))
-            # now write some logic for what to return
-            best = {"matches": 0, 'key': None}
-            if not level:
-                for k in hits.keys():
-                    for entry in hits[k]:
-                        if entry[1] > best['matches']:
-                            best['key'] = entry[0]['key']
-                            best['matches'] = entry[1]
+            return None
+        return best(hits[use])
+
+    def _series(self, statement, terms, level=None, exclude=None, concept=None, parent=None):
+        '''
+        What search (or lookup when there's a concept) finds in every report, oldest first. The last query_cache_size
+        of these are remembered, so asking for the same thing again is a dict lookup until the reports change. Terms
+        are sorted and exclude made a set for the key since neither order matters to search
+        :return: TUPLE the value found in each report, None where nothing was found
+        '''
+        # concept and parent go in as the names they stand for, so changing concept_aliases can't hand back old series
+        def names(x):
+            return tuple(self.concept_aliases.get(x, [x])) if x else None
+        key = (statement, names(concept), tuple(sorted(terms or ())), level or None, frozenset(exclude or ()), names(parent),
+               self._version)
+        series = self._queries.get(key)
+        if series is not None:
+            self._queries.move_to_end(key)
+            return series
+        values = []
+        for i in range(len(self.reports) - 1, -1, -1):
+            if concept:
+                val = self.lookup(statement, i, concept, terms, level=level, exclude=exclude, parent=parent)
             else:
-                use = level
-                if level not in hits.keys():
-                    lv_list = list(hits.keys())
-                    lv_list.sort()
-                    if level <= 0:
-                        use = lv_list[0]
-                    elif level > len(lv_list) - 1:
-                        use = lv_list[-1]
-                    else:
-                        use = level
-                for entry in hits[use]:
-                    if entry[1] > best['matches']:
-                        best['key'] = entry[0]['key']
-                        best['matches'] = entry[1]
-        val = best['key']
-        # print(base)
-        # print(val)
-        eval_string = base_str + val
-        ret = eval(eval_string)
-        return ret
+                val = self.search(statement, i, terms, level=level, exclude=exclude, parent=parent)
+            values.append(val['value'] if val else None)
+        series = tuple(values)
+        self._queries[key] = series
+        while len(self._queries) > self.query_cache_size:
+            self._queries.popitem(last=False)
+        return series
 
-    def timespan(self, statement, terms, level=None, exclude=None):
+    def lookup(self, statement, record, concept, terms=None, level=None, exclude=None, parent=None):
+        '''
+        Finds an entry by its concept name instead of by scoring words, which is a dict lookup and never picks the
+        wrong item because it happened to share more words with the terms
+        :param statement: STRING ['balance_sheet', 'cash_flows', 'income_statement']
+        :param concept: STRING a name from concept_aliases like 'cash', or a concept name like 'AssetsCurrent'
+        :param terms: LIST if given and the statement has none of the concept names, search with these instead
+        :param level: INT passed on to search
+        :param exclude: LIST passed on to search
+        :param parent: STRING only look under this item, see search
+        :return: the entry's table node, None if it isn't there
+        '''
+        statements = [
+            'balance_sheet',
+            'cash_flows',
+            'income_statement'
+        ]
+        if statement not in statements:
+            return None
+        data = self.reports[record]['data']
+        if data is None:
+            return None  # still being fetched, see lazy and iter_reports
+        base = data[statement]['table']
+        index = self._word_index(data[statement]['flatlist'])
+        within = self._under(index, parent) if parent else None
+        for name in self.concept_aliases.get(concept, [concept]):
+            found = index.concepts.get(name.lower(), ())
+            if within is not None:
+                found = [x for x in found if x in within]
+            if found:
+                return table_node(base, entry_path(index.entries[found[0]]))
+        if terms:
+            return self.search(statement, record, terms, level=level, exclude=exclude, parent=parent)
+        return None
+
+    def timespan(self, statement, terms, level=None, exclude=None, parent=None):
         ret = []
         # test = grabber.search(statement, 0, terms, level=level, exclude=exclude)
         # print(terms)
         # print(test)
-        for i in range(0, len(self.reports)):
-            val = grabber.search(statement, i, terms, level=level, exclude=exclude)
-            if not val['value']:
+        for val in self._series(statement, terms, level=level, exclude=exclude, parent=parent):
+            if not val:
                 val = float(0)
             else:
-                val = float(val['value'])
+                val = float(val)
                 # print("Adding value: {}".format(val))
             ret.append(val)
-        return ret[::-1]
+        return ret
+
+    def timespans(self, queries):
+        '''
+        timespan for several things at once, each column comes from the same remembered series timespan uses
+        :param queries: DICT name -> DICT the arguments for search, 'statement' and 'terms' and optionally 'level'
+        and 'exclude', e.g. {'cash': {'statement': 'balance_sheet', 'terms': ['cash'], 'exclude': ['restricted']}}.
+        Give a query a 'concept' and it goes through lookup, with the terms only used when that finds nothing, and a
+        'parent' to only look under that item
+        :return: pandas DataFrame indexed by report date oldest first with a column for each query, unlike timespan
+        anything that wasn't found is NaN instead of 0. So is every column of a report that hasn't been fetched yet
+        (lazy or in the middle of iter_reports), its row gets filled in once it has been and this is asked again
+        '''
+        names = list(queries.keys())
+        values = np.full((len(self.reports), len(names)), np.nan)
+        for j, name in enumerate(names):
+            query = queries[name]
+            series = self._series(query['statement'], query.get('terms'), level=query.get('level'),
+                                  exclude=query.get('exclude'), concept=query.get('concept'), parent=query.get('parent'))
+            for row, val in enumerate(series):
+                if val is not None:
+                    values[row, j] = float(val)
+        return pandas.DataFrame(values, index=pandas.to_datetime(self.dates()), columns=names)
 
     def dates(self):
         def dfroms(s):
@@ -388,6 +803,9 @@ class DataGrabber():
             stuff.append(dfroms(val))
         return stuff[::-1]
 
+#shared by every DataGrabber, call tickers.refresh() to download the mapping
+tickers = TickerIndex()
+
 def g(x):
         print(json.dumps(x, indent=3))
 def dfroms(s):
@@ -400,42 +818,43 @@ def pr(l):
     for i in l:
         print(i)
 
+operations = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+}
+
 def list_operate(f, l1, l2):
     if len(l1) != len(l2):
         return None
     else:
         nl = []
+        op = operations[f]
         for i in range(0, len(l1)):
-            eval_me = "l1[{}] {} l2[{}]".format(i, f, i)
-            nl.append(eval(eval_me))
+            nl.append(op(l1[i], l2[i]))
         return nl
 
 if __name__ == "__main__":
     fname = '20180405mon'
     grabber = DataGrabber("MBII", file=True)  # try to get data for a relatively small company!
 
-    current_assets = grabber.timespan("balance_sheet", ['assets', 'current', 'assets', 'current'])
-    current_liabilities = grabber.timespan("balance_sheet", ['liabilities', 'current', 'liabilities', 'current'], exclude=['equity'])
-
-    cash = grabber.timespan("balance_sheet", ['cash', 'equivalents', 'and', 'cash'], exclude=['investments', 'investment', 'restricted'])
-    investments = grabber.timespan("balance_sheet", ['short', 'term', 'investments'], exclude=['net', 'total', 'and'])
-    receivables = grabber.timespan("balance_sheet", ['accounts', 'receivable', 'net'])
-    # print("Investments")
-    # pr(investments)
-    # print("Cash")
-    # pr(cash)
-    # print("AL")
-
-    debt = grabber.timespan("balance_sheet", ['current', 'current', 'debt', 'debt'], exclude=['assets', 'liabilities'])
-    payables = grabber.timespan("balance_sheet", ['accounts', 'payable', 'net', 'current'], exclude=['receivable'])
-    other = grabber.timespan("balance_sheet", ['other', 'current', 'liabilities'])
+    frame = grabber.timespans({
+        'current_assets': {'statement': "balance_sheet", 'terms': ['assets', 'current', 'assets', 'current']},
+        'current_liabilities': {'statement': "balance_sheet", 'terms': ['liabilities', 'current', 'liabilities', 'current'], 'exclude': ['equity']},
+        'cash': {'statement': "balance_sheet", 'terms': ['cash', 'equivalents', 'and', 'cash'], 'exclude': ['investments', 'investment', 'restricted']},
+        'investments': {'statement': "balance_sheet", 'terms': ['short', 'term', 'investments'], 'exclude': ['net', 'total', 'and']},
+        'receivables': {'statement': "balance_sheet", 'terms': ['accounts', 'receivable', 'net']},
+        'debt': {'statement': "balance_sheet", 'terms': ['current', 'current', 'debt', 'debt'], 'exclude': ['assets', 'liabilities']},
+        'payables': {'statement': "balance_sheet", 'terms': ['accounts', 'payable', 'net', 'current'], 'exclude': ['receivable']},
+        'other': {'statement': "balance_sheet", 'terms': ['other', 'current', 'liabilities']}
+    }).fillna(0.0)  # missing values counted as 0 like timespan does
+    # print(frame)
 
-    bot = list_operate('+', debt, payables)
-    bot = list_operate('+', bot, other)
+    bot = frame['debt'] + frame['payables'] + frame['other']
 
-    top = list_operate('+', cash, investments)
-    top = list_operate('+', top, receivables)
-    quick = list_operate('/', top, other)
+    top = frame['cash'] + frame['investments'] + frame['receivables']
+    quick = top / frame['other']
 
     # print("DEBT:")
     # pr(debt)
@@ -459,7 +878,7 @@ if __name__ == "__main__":
     # al = list_operate('-', current_assets, current_liabilities)
     # pr(al)
 
-    dates = grabber.dates()
+    dates = frame.index
     # pr(dates)
 
     # print(json.dumps(grabber.search("balance_sheet",20, ['assets', 'assets'], exclude=['current', 'equity', 'liabilities']), indent=2))
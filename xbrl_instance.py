@@ -0,0 +1,176 @@
+from lxml import etree
+from collections import namedtuple
+import datetime
+
+'''
+Streaming reader for XBRL instance documents. Instead of building the whole tree like BeautifulSoup does, the parser
+is fed the document a piece at a time, pulls the contexts, units and facts out of each top level element as soon as
+it is complete and then throws the element away, so memory stays flat no matter how big the filing is.
+
+index_soup builds the same Instance out of a document that was already parsed with BeautifulSoup, so everything
+after parsing does dictionary lookups whichever way the instance was read.
+'''
+
+def _local(tag):
+	return tag.rpartition('}')[2]
+
+def _date(s):
+	if not s:
+		return None
+	return datetime.date.fromisoformat(s.strip()[0:10])
+
+#period is 'instant', 'duration' or 'forever', dimensional is True when the context has a segment or scenario
+Context = namedtuple('Context', ['id', 'period', 'start', 'end', 'instant', 'dimensional'])
+
+class Instance():
+	'''
+	contexts: id -> Context with real dates
+	units: id -> measure, a divide unit becomes "numerator/denominator"
+	facts: lower cased concept name without its prefix -> {contextref: (value, unitref, decimals)}
+	'''
+	def __init__(self):
+		self.contexts = {}
+		self.units = {}
+		self.facts = {}
+		self._undimensioned = {'instant': set(), 'duration': set(), 'forever': set()}
+
+	def add_context(self, cid, start=None, end=None, instant=None, dimensional=False):
+		start, end, instant = _date(start), _date(end), _date(instant)
+		if instant:
+			period = 'instant'
+		elif start or end:
+			period = 'duration'
+		else:
+			period = 'forever'
+		self.contexts[cid] = Context(cid, period, start, end, instant, dimensional)
+		if not dimensional:
+			self._undimensioned[period].add(cid)
+
+	def undimensioned(self, period):
+		'''
+		:param period: STRING 'instant', 'duration' or 'forever'
+		:return: SET ids of the contexts of that kind that aren't broken down by some axis
+		'''
+		return self._undimensioned[period]
+
+	def add_fact(self, concept, ctex, value, unit=None, decimals=None):
+		by_context = self.facts.setdefault(concept, {})
+		if ctex not in by_context:
+			by_context[ctex] = (value, unit, decimals)
+
+
+class InstanceParser():
+	'''
+	Feed it bytes with feed() as they come in, close() returns the finished Instance
+	'''
+	def __init__(self):
+		self.instance = Instance()
+		self._parser = etree.XMLPullParser(events=('start', 'end'), huge_tree=True, remove_comments=True, remove_pis=True)
+		self._depth = 0
+
+	def feed(self, data):
+		self._parser.feed(data)
+		self._drain()
+
+	def close(self):
+		self._parser.close()
+		self._drain()
+		return self.instance
+
+	def _drain(self):
+		for event, el in self._parser.read_events():
+			if event == 'start':
+				self._depth += 1
+				continue
+			self._depth -= 1
+			if self._depth != 1:
+				continue
+			self._read(el)
+			el.clear()
+			while el.getprevious() is not None:
+				del el.getparent()[0]
+
+	def _read(self, el):
+		name = _local(el.tag)
+		if name == 'context':
+			self._read_context(el)
+		elif name == 'unit':
+			self._read_unit(el)
+		elif el.get('contextRef'):
+			self._read_fact(el)
+		else:
+			#tuples hold their facts one level down
+			for child in el.iterdescendants():
+				if child.get('contextRef'):
+					self._read_fact(child)
+
+	def _read_context(self, el):
+		start = end = instant = None
+		dimensional = False
+		for child in el.iter():
+			name = _local(child.tag)
+			if name == 'segment' or name == 'scenario':
+				dimensional = True
+			elif name == 'startDate':
+				start = child.text
+			elif name == 'endDate':
+				end = child.text
+			elif name == 'instant':
+				instant = child.text
+		self.instance.add_context(el.get('id'), start, end, instant, dimensional)
+
+	def _read_unit(self, el):
+		measures = [child.text.strip() for child in el.iter() if _local(child.tag) == 'measure']
+		self.instance.units[el.get('id')] = '/'.join(measures)
+
+	def _read_fact(self, el):
+		concept = _local(el.tag)
+		if concept.endswith('TextBlock'):
+			return #whole notes to the statements, nothing here reads them and they are most of the document
+		value = el.text
+		if value is not None:
+			value = value.strip()
+		self.instance.add_fact(concept.lower(), el.get('contextRef'), value, el.get('unitRef'), el.get('decimals'))
+
+
+def parse_instance(data, chunk_size=1024*1024):
+	'''
+	:param data: BYTES the whole instance document
+	:return: Instance
+	'''
+	parser = InstanceParser()
+	for i in range(0, len(data), chunk_size):
+		parser.feed(data[i:i + chunk_size])
+	return parser.close()
+
+
+def index_soup(soup):
+	'''
+	One walk over an instance parsed by BeautifulSoup in lxml's html mode, where tag and attribute names come out
+	lower cased
+	:param soup: BeautifulSoup of the instance document
+	:return: Instance
+	'''
+	instance = Instance()
+	for tag in soup.find_all(True):
+		name = tag.name.rpartition(':')[2]
+		if name == 'context':
+			start = end = instant = None
+			dimensional = False
+			for child in tag.find_all(True):
+				part = child.name.rpartition(':')[2]
+				if part == 'segment' or part == 'scenario':
+					dimensional = True
+				elif part == 'startdate':
+					start = child.text
+				elif part == 'enddate':
+					end = child.text
+				elif part == 'instant':
+					instant = child.text
+			instance.add_context(tag.get('id'), start, end, instant, dimensional)
+		elif name == 'unit':
+			measures = [child.text.strip() for child in tag.find_all(True) if child.name.rpartition(':')[2] == 'measure']
+			instance.units[tag.get('id')] = '/'.join(measures)
+		elif tag.get('contextref') and not name.endswith('textblock'):
+			instance.add_fact(name, tag['contextref'], tag.text.strip(), tag.get('unitref'), tag.get('decimals'))
+	return instance